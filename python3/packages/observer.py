@@ -20,71 +20,191 @@ If there are no *observer.conf files or something fails, this script runs the
 passed script without any instrumentation.
 """
 
-import configparser
 import functools
-import inspect
+import itertools
 import logging
 import os
-import runpy
 import sys
 import traceback
 import types
-from datetime import datetime, timezone
-from logging.handlers import SysLogHandler
-from typing import List, Sequence
+from typing import Dict, List, Sequence, Tuple
 
 # The opentelemetry library may generate exceptions we aren't expecting, this code
 # must not fail or it will cause the pass-through script to fail when at worst
 # this script should be a noop. As such, we sometimes need to catch broad exceptions:
 # pylint: disable=broad-exception-caught, too-many-locals, too-many-statements
-# wrapt.decorator adds the extra parameters so we shouldn't provide them:
-# pylint: disable=no-value-for-parameter
-# We only want to import opentelemetry libraries if instrumentation is enabled
+# We only want to import opentelemetry libraries if instrumentation is enabled,
+# and modules only used for tracing (like inspect) are also imported only then:
 # pylint: disable=import-outside-toplevel
 
 DEBUG_ENABLED = os.getenv("XAPI_TEST")
 DEFAULT_MODULES = "LVHDSR,XenAPI,SR,SRCommand,util"
+# Methods not to instrument, to avoid RecursionError:
+# 'maximum recursion depth exceeded in comparison'
+# in the XenAPI module (triggered by XMLRPC calls in it).
+# __repr__ and __str__ are called to record the arguments of traced calls,
+# and __new__ and __del__ can run during interpreter shutdown. These are
+# skipped even if instrument_exclude_patterns does not exclude them:
+SKIPPED_METHODS = frozenset(
+    {"__getattr__", "__call__", "__init__", "__new__", "__del__", "__repr__", "__str__"}
+)
+# Used to compress the rotated bugtool files (xs-trace reads .ndjson.zst files):
+ZSTD = "/usr/bin/zstd"
 FORMAT = "observer.py: %(message)s"
-handler = SysLogHandler(facility="local5", address="/dev/log")
-logging.basicConfig(format=FORMAT, handlers=[handler])
-syslog = logging.getLogger(__name__)
+
+
+class _LazySysLogHandler(logging.Handler):
+    """Log to syslog, but connect to /dev/log only when the first record is logged"""
+
+    def __init__(self):
+        super().__init__()
+        self.syslog_handler = None
+
+    def emit(self, record):
+        if not self.syslog_handler:
+            self.syslog_handler = self.create_syslog_handler()
+        self.syslog_handler.emit(record)
+
+    def create_syslog_handler(self):
+        """Return the handler to emit to, a NullHandler if there is no syslog."""
+        if not os.path.exists("/dev/log"):  # e.g. in containers or test runners
+            return logging.NullHandler()
+
+        from logging.handlers import SysLogHandler
+
+        try:
+            syslog_handler = SysLogHandler(facility="local5", address="/dev/log")
+        except OSError:
+            return logging.NullHandler()
+        syslog_handler.setFormatter(self.formatter)
+        return syslog_handler
+
+    def close(self):
+        if self.syslog_handler:
+            self.syslog_handler.close()
+        super().close()
+
+
+# Not on the root logger (using logging.basicConfig()): That would also send the
+# log records of the traced script to syslog and turn its basicConfig() into a noop
+syslog = logging.getLogger("observer")
+if not syslog.handlers:  # observer.py can run more than once, e.g. in the tests
+    handler = _LazySysLogHandler()
+    handler.setFormatter(logging.Formatter(FORMAT))
+    syslog.addHandler(handler)
+
+
+def _debug_noop(*_args, **_kwargs):
+    """Noop debug(). Used instead of syslog.debug() unless XAPI_TEST is set."""
+
+
 if DEBUG_ENABLED:
     syslog.setLevel(logging.DEBUG)
+    debug = syslog.debug
 else:
     syslog.setLevel(logging.INFO)
-debug = syslog.debug
+    # Skips the isEnabledFor() call of syslog.debug() on each debug() call:
+    debug = _debug_noop
 
 
 def _get_configs_list(config_dir):
     try:
         # There can be many observer config files in the configuration directory
-        return [
-            f"{config_dir}/{f}"
-            for f in os.listdir(config_dir)
-            if os.path.isfile(os.path.join(config_dir, f))
-            and f.endswith("observer.conf")
-        ]
-    except FileNotFoundError as err:
+        # scandir() gets the file type of the entries without a stat() for each.
+        # Sorted, as the directory order is arbitrary and the first config's
+        # tracer creates the spans:
+        with os.scandir(config_dir) as entries:
+            return sorted(
+                entry.path
+                for entry in entries
+                if entry.name.endswith("observer.conf") and entry.is_file()
+            )
+    except (FileNotFoundError, NotADirectoryError) as err:
         debug("configs exception: %s", err)
         return []
 
 
-def read_config(config_path, header):
+# Parsed config files by path, with the (inode, mtime) they were parsed at.
+# Keyed by path only, so a changed file replaces its old entry:
+_CONFIG_CACHE: Dict[str, Tuple[Tuple[int, int], Dict[str, str]]] = {}
+
+
+def read_config(config_path):
     """Read a config file and return a dictionary of key-value pairs."""
 
-    parser = configparser.ConfigParser(interpolation=None)
+    try:
+        stat = os.stat(config_path)
+        version = (stat.st_ino, stat.st_mtime_ns)
+    except OSError:
+        version = None  # Not cached, open() raises the error for the caller
+    cached = _CONFIG_CACHE.get(config_path)
+    if version and cached and cached[0] == version:
+        return cached[1]
+
+    # The files are flat lists of key=value lines: configparser isn't needed,
+    # but keys are lowercased like by it for compatibility with it:
+    config = {}
     with open(config_path, encoding="utf-8") as config_file:
-        try:
-            parser.read_string(f"[{header}]\n{config_file.read()}")
-        except configparser.ParsingError as e:
-            debug("read_config(): invalid config file %s: %s", config_path, e)
-            return {}
+        for line in config_file:
+            line = line.strip()
+            if not line or line.startswith(("#", ";", "[")):
+                continue
+            # Like configparser, the first "=" or ":" separates the key and value:
+            if ":" in line.partition("=")[0]:
+                key, sep, value = line.partition(":")
+            else:
+                key, sep, value = line.partition("=")
+            if not sep:
+                debug("read_config(): invalid config file %s: %s", config_path, line)
+                return {}
+            config[key.strip().lower()] = value.strip().strip("'")
 
-    config = {k: v.strip("'") for k, v in dict(parser[header]).items()}
     debug("%s: %s", config_path, config)
+    if version:
+        _CONFIG_CACHE[config_path] = (version, config)
     return config
 
 
+def _parse_resource_attributes(config):
+    """Return the otel_resource_attributes (key=value,...) of a config as a dict."""
+
+    # partition() does not fail on values containing "=", unlike split("=")
+    resource_attributes = {}
+    for item in config.get("otel_resource_attributes", "").split(","):
+        key, sep, value = item.partition("=")
+        if sep:
+            resource_attributes[key] = value
+    return resource_attributes
+
+
+@functools.lru_cache(maxsize=4096)
+def _signature_of(function, bound=False):
+    """
+    Return the inspect.Signature of the function, cached per function object.
+
+    Bound methods are created anew on each attribute access, so they are cached
+    by their underlying function with the bound (first) parameter removed, which
+    is what inspect.signature() returns for a bound method.
+    Returns None if the function has no signature (its arguments are not traced).
+    """
+    import inspect  # Only imported when tracing: It is not needed otherwise
+
+    try:
+        signature = inspect.signature(function)
+    except (TypeError, ValueError) as e:
+        debug("_signature_of(%s): %s", function, e)
+        return None
+    parameters = tuple(signature.parameters.values())
+    # Like for a bound method, only a positional first parameter is removed: A
+    # leading *args also gets the instance, but remains for the other arguments.
+    if bound and parameters and parameters[0].kind in (
+        inspect.Parameter.POSITIONAL_ONLY,
+        inspect.Parameter.POSITIONAL_OR_KEYWORD,
+    ):
+        signature = signature.replace(parameters=parameters[1:])
+    return signature
+
+
 def _span_noop(wrapped=None, span_name_prefix=""):
     """Noop decorator. Overridden by _init_tracing() if there are configs."""
     if wrapped is None:
@@ -97,6 +217,15 @@ def _patch_module_noop(_):
     """Noop patch_module. Overridden by _init_tracing() if there are configs."""
 
 
+def _traceparent_is_sampled():
+    """Return whether the TRACEPARENT to continue has the sampled trace flag set."""
+    trace_flags = os.getenv("TRACEPARENT", "").rpartition("-")[2]
+    try:
+        return bool(int(trace_flags, 16) & 1)
+    except ValueError:
+        return False
+
+
 def _init_tracing(configs: List[str], config_dir: str):
     """
     Initialise tracing with the given configuration files.
@@ -113,6 +242,31 @@ def _init_tracing(configs: List[str], config_dir: str):
         return _span_noop, _patch_module_noop
 
     try:
+        config_dict = read_config(f"{config_dir}/all.conf")
+    except FileNotFoundError:
+        config_dict = {}
+    module_names = config_dict.get("module_names", DEFAULT_MODULES).split(",")
+    debug("module_names: %s", module_names)
+    # If set, only trace these scripts: Don't set up tracing for other scripts
+    traced_scripts = config_dict.get("traced_scripts")
+    script = os.path.basename(sys.argv[0])
+    if traced_scripts and script not in traced_scripts.split(","):
+        debug("%s is not in traced_scripts, not tracing it", script)
+        return _span_noop, _patch_module_noop
+    # With sampling_ratio=0, only the continued sampled traces are recorded:
+    # If TRACEPARENT isn't sampled, no span would be recorded, so don't set up:
+    sampling_ratio = config_dict.get("sampling_ratio")
+    if sampling_ratio and float(sampling_ratio) == 0 and not _traceparent_is_sampled():
+        debug("sampling_ratio=0 and TRACEPARENT is not sampled, not tracing")
+        return _span_noop, _patch_module_noop
+
+    try:
+        import fnmatch
+        import re
+        import reprlib
+        import subprocess
+        import threading
+        from datetime import datetime, timezone
         from warnings import simplefilter
 
         # On 3.10-3.12, the import of wrapt might trigger warnings, filter them:
@@ -124,6 +278,7 @@ def _init_tracing(configs: List[str], config_dir: str):
         from opentelemetry.sdk.resources import Resource
         from opentelemetry.sdk.trace import TracerProvider
         from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExportResult
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
         from opentelemetry.trace.propagation.tracecontext import (
             TraceContextTextMapPropagator,
         )
@@ -132,11 +287,64 @@ def _init_tracing(configs: List[str], config_dir: str):
         return _span_noop, _patch_module_noop
 
     try:
-        config_dict = read_config(f"{config_dir}/all.conf", header="default")
-    except FileNotFoundError:
-        config_dict = {}
-    module_names = config_dict.get("module_names", DEFAULT_MODULES).split(",")
-    debug("module_names: %s", module_names)
+        # Optional: If installed, orjson is used to serialize the spans to the file
+        import orjson  # type: ignore[import-not-found]
+        from opentelemetry.exporter.zipkin.json.v2 import JsonV2Encoder
+    except ImportError:
+        orjson = None
+
+    # Record the arguments of the traced calls (skips the signature when false):
+    capture_args = config_dict.get("capture_args", "true") == "true"
+    # Set one attribute per argument instead of one attribute for all arguments:
+    detailed_args = config_dict.get("detailed_args") == "true"
+    # Large arguments (e.g. long strings, bytes or lists) are abbreviated by reprlib
+    # instead of copying their full repr into each span (and then exporting it):
+    max_arg_length = int(config_dict.get("max_arg_length", 256))
+    arg_repr = reprlib.Repr()
+    arg_repr.maxstring = arg_repr.maxother = arg_repr.maxlong = max_arg_length
+
+    def value_of_arg(value):
+        """Return the attribute value to record for an argument of a traced call."""
+        if isinstance(value, (bool, int, float)):
+            return value
+        if isinstance(value, str) and len(value) <= max_arg_length:
+            return value
+        return arg_repr.repr(value)
+
+    # Sample this ratio of the traces which are not continued from a sampled parent,
+    # when not set, use the default sampler (configurable by OTEL_TRACES_SAMPLER):
+    sampler = None
+    if sampling_ratio:
+        sampler = ParentBased(TraceIdRatioBased(float(sampling_ratio)))
+    # Don't instrument the functions and methods with names matching these patterns:
+    exclude_patterns = config_dict.get("instrument_exclude_patterns", "__*")
+    exclude_regex = "|".join(
+        fnmatch.translate(pattern) for pattern in exclude_patterns.split(",") if pattern
+    )
+    is_excluded = re.compile(exclude_regex).match if exclude_regex else lambda _: None
+    # Instrument staticmethods and classmethods only when enabled:
+    method_types: Tuple[type, ...] = (types.FunctionType,)
+    if config_dict.get("instrument_static_and_class_methods") == "true":
+        method_types += (staticmethod, classmethod)
+    # Export bigger batches less often than by default (2048 spans, 512 per 5s):
+    batch_processor_args = {
+        "max_queue_size": int(config_dict.get("max_queue_size", 8192)),
+        "max_export_batch_size": int(config_dict.get("max_export_batch_size", 1024)),
+        "schedule_delay_millis": int(config_dict.get("schedule_delay_millis", 2000)),
+    }
+    # Rotate the bugtool files when they reach this size (they are compressed then):
+    max_file_bytes = int(config_dict.get("bugtool_max_file_bytes", 16 * 1024 * 1024))
+
+    if orjson:
+
+        class OrjsonV2Encoder(JsonV2Encoder):
+            """JsonV2Encoder which serializes the spans to JSON bytes using orjson."""
+
+            def serialize(self, spans, local_endpoint):
+                encoded_local_endpoint = self._encode_local_endpoint(local_endpoint)
+                return orjson.dumps(
+                    [self._encode_span(span, encoded_local_endpoint) for span in spans]
+                )
 
     # pylint: disable=too-few-public-methods
     class FileZipkinExporter(ZipkinExporter):
@@ -144,55 +352,126 @@ def _init_tracing(configs: List[str], config_dir: str):
 
         def __init__(self, *args, **kwargs):
             self.bugtool_filename_callback = kwargs.pop("filename_callback")
-            self.bugtool_filename = self.bugtool_filename_callback()
             self.trace_log_dir = kwargs.pop("trace_log_dir")
-            debug("bugtool filename=%s", self.bugtool_filename)
+            os.makedirs(name=self.trace_log_dir, exist_ok=True)
+            # Opened on the first export: No empty file if no span is sampled
+            self.bugtool_file = None
             self.bytes_written = 0
             super().__init__(*args, **kwargs)
+            if orjson and isinstance(self.encoder, JsonV2Encoder):
+                self.encoder = OrjsonV2Encoder(self.encoder.max_tag_value_length)
+
+        def open_bugtool_file(self):
+            """Open a new bugtool file, kept open (and buffered) for the exports."""
+            self.bugtool_filename = self.bugtool_filename_callback()
+            debug("bugtool filename=%s", self.bugtool_filename)
+            # pylint: disable-next=consider-using-with
+            return open(self.bugtool_filename, "ab", buffering=1 << 16)
 
         def export(self, spans: Sequence[trace.Span]) -> SpanExportResult:
             """Export the given spans to the file endpoint."""
 
             data = self.encoder.serialize(spans, self.local_node)
-            datastr = str(data)
-            debug("data.type=%s,data.len=%s", type(data), len(datastr))
-            debug("data=%s", datastr)
-            os.makedirs(name=self.trace_log_dir, exist_ok=True)
-
-            with open(self.bugtool_filename, "a", encoding="utf-8") as bugtool_file:
-                bugtool_file.write(f"{datastr}\n")  # ndjson
-            self.bytes_written += len(data)
-
-            # Create new file if it gets > 1MB
-            if self.bytes_written > 1024 * 1024:
-                self.bugtool_filename = self.bugtool_filename_callback()
+            if isinstance(data, str):  # Not using orjson
+                data = data.encode("utf-8")
+            if syslog.isEnabledFor(logging.DEBUG):  # Skip this for every batch
+                debug("data.type=%s,data.len=%s", type(data), len(data))
+                debug("data=%s", data)
+
+            if not self.bugtool_file:  # The first export, or the first after rotation
+                self.bugtool_file = self.open_bugtool_file()
+            self.bugtool_file.write(data)
+            self.bugtool_file.write(b"\n")  # ndjson
+            self.bytes_written += len(data) + 1
+
+            # Create new file if it gets > max_file_bytes, and compress the full one
+            if self.bytes_written > max_file_bytes:
+                self.bugtool_file.close()
+                # Reset first: The next export must open a new file in any case
+                self.bugtool_file = None
                 self.bytes_written = 0
+                try:
+                    threading.Thread(
+                        target=self.compress_file, args=(self.bugtool_filename,)
+                    ).start()
+                except RuntimeError as e:  # e.g. at interpreter shutdown
+                    debug("compress_file(): %s: %s", self.bugtool_filename, e)
 
             return SpanExportResult.SUCCESS
 
-    def create_tracer_from_config(path):
-        """Create a tracer from a config file."""
+        @staticmethod
+        def compress_file(filename):
+            """Compress the file to filename.zst and remove it, like xapi does."""
+            try:
+                subprocess.run(
+                    [ZSTD, "--fast", "--rm", "-q", filename],
+                    check=True,
+                    stdin=subprocess.DEVNULL,
+                )
+            except (OSError, subprocess.CalledProcessError) as e:
+                debug("compress_file(): %s: %s", filename, e)
+
+        def shutdown(self) -> None:
+            """Close (and flush) the bugtool file when the exporter is shut down."""
+            if self.bugtool_file:
+                self.bugtool_file.close()
+            super().shutdown()
+
+    traceparent = os.getenv("TRACEPARENT", None)
+    propagator = TraceContextTextMapPropagator()
+    context.attach(propagator.extract({"traceparent": traceparent}))
+
+    # The OTEL_* variables are described in the sdk/environment_variables.html
+    # page of the opentelemetry-python.readthedocs.io documentation:
+    observer_configs = {path: read_config(path) for path in configs}
+    # Parsed once, for the environment variable and for the exporters of each config:
+    resource_attributes_of = {
+        path: _parse_resource_attributes(config)
+        for path, config in observer_configs.items()
+    }
+
+    # OTEL requires some attributes e.g. service.name to be in the environment
+    # variable: Set it once, merged from all configs (not just from the last one):
+    resource_attributes = {}
+    for config_resource_attributes in resource_attributes_of.values():
+        resource_attributes.update(config_resource_attributes)
+    if resource_attributes:
+        os.environ["OTEL_RESOURCE_ATTRIBUTES"] = ",".join(
+            f"{key}={value}" for key, value in resource_attributes.items()
+        )
+
+    # A single tracer provider exports to the destinations of all configs:
+    # The global tracer provider can be set only once per process, so a provider
+    # per config would leave the destinations of all but the first config unused.
+    provider = TracerProvider(
+        resource=Resource.create(
+            W3CBaggagePropagator().extract({}, resource_attributes)
+        ),
+        sampler=sampler,
+    )
 
-        otelvars = "opentelemetry-python.readthedocs.io/en/latest/sdk/environment_variables.html"
-        config = read_config(path, header=otelvars)
-        config_otel_resource_attrs = config.get("otel_resource_attributes", "")
+    # The bugtool directories and Zipkin endpoints that have an exporter: All
+    # configs share the provider, so a second exporter would export spans twice:
+    destinations = set()
 
-        if config_otel_resource_attrs:
-            # OTEL requires some attributes e.g. service.name
-            # to be in the environment variable
-            os.environ["OTEL_RESOURCE_ATTRIBUTES"] = config_otel_resource_attrs
+    def add_exporters_of_config(path, config, otel_resource_attrs):
+        """Add the exporters of a config file, except for duplicate destinations."""
 
         trace_log_dir = config.get("xs_exporter_bugtool_endpoint", "")
+        if trace_log_dir in destinations:
+            debug("%s: %s has an exporter already", path, trace_log_dir)
+            trace_log_dir = ""  # No second exporter for the same directory
+        elif trace_log_dir:
+            destinations.add(trace_log_dir)
 
         zipkin_endpoints = config.get("xs_exporter_zipkin_endpoints")
-        otel_exporter_zipkin_endpoints = (
-            zipkin_endpoints.split(",") if zipkin_endpoints else []
-        )
-        otel_resource_attrs = dict(
-            item.split("=")
-            for item in config.get("otel_resource_attributes", "").split(",")
-            if "=" in item
-        )
+        otel_exporter_zipkin_endpoints = []
+        for zipkin_endpoint in zipkin_endpoints.split(",") if zipkin_endpoints else []:
+            if zipkin_endpoint in destinations:
+                debug("%s: %s has an exporter already", path, zipkin_endpoint)
+                continue
+            destinations.add(zipkin_endpoint)
+            otel_exporter_zipkin_endpoints.append(zipkin_endpoint)
 
         service_name = config.get(
             "otel_service_name", otel_resource_attrs.get("service.name", "unknown")
@@ -201,26 +480,14 @@ def _init_tracing(configs: List[str], config_dir: str):
         # Remove . to prevent users changing directories in the bugtool_filenamer
         tracestate = os.getenv("TRACESTATE", "unknown").strip("'").replace(".", "")
 
-        # rfc3339
-        def bugtool_filenamer():
-            """Return an rfc3339-compliant ndjson file name."""
-            now = datetime.now(timezone.utc).isoformat()
-            return (
-                f"{trace_log_dir}/{service_name}-{host_uuid}-{tracestate}-{now}.ndjson"
-            )
-
-        traceparent = os.getenv("TRACEPARENT", None)
-        propagator = TraceContextTextMapPropagator()
-        context_with_traceparent = propagator.extract({"traceparent": traceparent})
+        # The rfc3339 start time, pid and file number make the file names unique:
+        file_prefix = f"{trace_log_dir}/{service_name}-{host_uuid}-{tracestate}-"
+        file_prefix += f"{datetime.now(timezone.utc).isoformat()}-{os.getpid()}-"
+        file_numbers = itertools.count()
 
-        context.attach(context_with_traceparent)
-
-        # Create a tracer provider with the given resource attributes
-        provider = TracerProvider(
-            resource=Resource.create(
-                W3CBaggagePropagator().extract({}, otel_resource_attrs)
-            )
-        )
+        def bugtool_filenamer():
+            """Return the ndjson file name for the next file of this process."""
+            return f"{file_prefix}{next(file_numbers):06d}.ndjson"
 
         # Add a span processor for each endpoint defined in the config
         if trace_log_dir:
@@ -228,27 +495,151 @@ def _init_tracing(configs: List[str], config_dir: str):
                 FileZipkinExporter(
                     filename_callback=bugtool_filenamer,
                     trace_log_dir=trace_log_dir
-                )
+                ),
+                **batch_processor_args,
             )
             provider.add_span_processor(processor_file_zipkin)
         for zipkin_endpoint in otel_exporter_zipkin_endpoints:
             processor_zipkin = BatchSpanProcessor(
-                ZipkinExporter(endpoint=zipkin_endpoint)
+                ZipkinExporter(endpoint=zipkin_endpoint), **batch_processor_args
             )
             provider.add_span_processor(processor_zipkin)
 
-        trace.set_tracer_provider(provider)
-        return trace.get_tracer(__name__)
+    for path, config in observer_configs.items():
+        add_exporters_of_config(path, config, resource_attributes_of[path])
 
-    tracers = list(map(create_tracer_from_config, configs))
-    debug("tracers=%s", tracers)
+    trace.set_tracer_provider(provider)
+    # Bound once here, so the traced calls don't need to look them up:
+    tracer = provider.get_tracer(__name__)
+    debug("tracer=%s", tracer)
+    start_as_current_span = tracer.start_as_current_span
+
+    # The helpers of span_of_tracers(), defined once here instead of on each call:
+    def instrument_function(wrapped, bound=False, span_name_prefix=""):
+        """
+        Return a function that creates a trace around calling wrapped.
+
+        A plain closure is used instead of a wrapt.decorator: It has no
+        per-call proxy and binding overhead, which matters on the hot path.
+        If wrapped is installed as a method (bound is True), its first argument
+        is the instance or class, which is not recorded in the span.
+        """
+        signature = None  # Without a signature, the arguments are not recorded
+        if capture_args and isinstance(wrapped, types.MethodType):
+            signature = _signature_of(wrapped.__func__, True)
+        elif capture_args and isinstance(wrapped, types.FunctionType):
+            signature = _signature_of(wrapped, bound)
+        skip = 1 if bound else 0
+        # Attribute keys of the arguments (when detailed_args is set), interned
+        # like the span name as they are shared by all spans of the function:
+        arg_keys = ()
+        if signature:
+            arg_keys = tuple(
+                sys.intern(f"xs.span.arg.{p}") for p in signature.parameters
+            )
+
+        module_name = getattr(wrapped, "__module__", "")
+        qual_name = getattr(wrapped, "__qualname__", "")
+
+        if not module_name and not qual_name:
+            span_name = str(wrapped)
+        else:
+            prefix = f"{span_name_prefix}:" if span_name_prefix else ""
+            span_name = sys.intern(f"{prefix}{module_name}:{qual_name}")
+
+        @functools.wraps(wrapped)
+        def wrapper(*args, **kwargs):
+            with start_as_current_span(span_name) as aspan:
+                bound_args = None
+                if signature and aspan.is_recording():
+                    try:
+                        bound_args = signature.bind(*args[skip:], **kwargs)
+                    except TypeError:
+                        # E.g. a method called through its class, without the
+                        # instance: Its arguments are not recorded, but the call
+                        # must not fail because of the tracing.
+                        debug("%s: Arguments not recorded", span_name, exc_info=True)
+                if bound_args is not None:
+                    if len(bound_args.arguments) < len(arg_keys):
+                        bound_args.apply_defaults()  # Not all were passed
+                    if detailed_args:
+                        # apply_defaults() added all arguments in parameter order
+                        attributes = {}
+                        for key, v in zip(arg_keys, bound_args.arguments.values()):
+                            attributes[key] = value_of_arg(v)
+                        aspan.set_attributes(attributes)  # One call for all
+                    else:
+                        arguments = ", ".join(
+                            f"{k!r}: {arg_repr.repr(v)}"
+                            for k, v in bound_args.arguments.items()
+                        )
+                        aspan.set_attribute("xs.span.args", f"{{{arguments}}}")
+
+                # must be inside "aspan" to produce nested trace
+                return wrapped(*args, **kwargs)
+
+        wrapper._xs_instrumented = True  # type: ignore[attr-defined]
+        return wrapper
+
+    def is_instrumented(function):
+        """Return whether a function (or static/classmethod) is instrumented."""
+        function = getattr(function, "__func__", function)
+        return getattr(function, "_xs_instrumented", False)
+
+    def instrument_method(method, span_name_prefix):
+        """Instrument a function, staticmethod or classmethod of a class."""
+        if isinstance(method, staticmethod):
+            function = method.__func__
+            return staticmethod(instrument_function(function, False, span_name_prefix))
+        if isinstance(method, classmethod):
+            function = method.__func__
+            return classmethod(instrument_function(function, True, span_name_prefix))
+        return instrument_function(method, True, span_name_prefix)
+
+    def autoinstrument_class(aclass, span_name_prefix=""):
+        """Auto-instrument the methods of a class (without setup spans)."""
+
+        # A snapshot, as setattr() changes the class __dict__ while iterating:
+        for method_name, method in list(aclass.__dict__.items()):
+            # Only methods: Replacing a nested class by a function breaks it
+            if (
+                method_name in SKIPPED_METHODS
+                or not isinstance(method, method_types)
+                or is_excluded(method_name)
+                or is_instrumented(method)  # e.g. when reloading a module
+            ):
+                continue
+            try:
+                instrumented_method = instrument_method(method, span_name_prefix)
+                setattr(aclass, method_name, instrumented_method)
+            except Exception:
+                # exc_info: The traceback is only formatted if debug is enabled
+                debug("setattr.instrument_function: Exception", exc_info=True)
+
+    def autoinstrument_module(amodule, span_name_prefix=""):
+        """Autoinstrument the classes and functions in a module."""
+
+        # Single pass over the module's namespace: inspect.getmembers() would
+        # sort all names and call getattr() for each of them (twice).
+        for name, member in list(vars(amodule).items()):
+            if isinstance(member, type):
+                # Instrument the methods of the classes in the module
+                try:
+                    autoinstrument_class(member, span_name_prefix)
+                except Exception:
+                    debug("instrument_function: Exception", exc_info=True)
+            elif isinstance(member, types.FunctionType):
+                # Instrument the module-level functions of the module
+                if not is_excluded(name) and not is_instrumented(member):
+                    function = instrument_function(member, False, span_name_prefix)
+                    setattr(amodule, name, function)
 
     def span_of_tracers(wrapped=None, span_name_prefix=""):
         """
         Public decorator that creates a trace around a function.
 
-        If there are no tracers, the function is called without any tracing.
-        If there are tracers, the function is called with a trace around it.
+        The function is called with a trace around it (span_of_tracers is only
+        used if there are tracers, otherwise _span_noop is used instead).
 
         It creates a span with the given span name prefix and then clones
         the returned span for each of the existing traces to produce a nested
@@ -268,89 +659,28 @@ def _init_tracing(configs: List[str], config_dir: str):
         if wrapped is None:  # handle decorators with parameters
             return functools.partial(span_of_tracers, span_name_prefix=span_name_prefix)
 
-        @wrapt.decorator
-        def instrument_function(wrapped, _, args, kwargs):
-            """Decorator that creates a trace around a function."""
-            if not tracers:
-                return wrapped(*args, **kwargs)
-
-            module_name = wrapped.__module__ if hasattr(wrapped, "__module__") else ""
-            qual_name = wrapped.__qualname__ if hasattr(wrapped, "__qualname__") else ""
-
-            if not module_name and not qual_name:
-                span_name = str(wrapped)
-            else:
-                prefix = f"{span_name_prefix}:" if span_name_prefix else ""
-                span_name = f"{prefix}{module_name}:{qual_name}"
-
-            tracer = tracers[0]
-            with tracer.start_as_current_span(span_name) as aspan:
-                if inspect.isclass(wrapped):
-                    # class or classmethod
-                    aspan.set_attribute("xs.span.args.str", str(args))
-                    aspan.set_attribute("xs.span.kwargs.str", str(kwargs))
-                elif isinstance(wrapped, wrapt.PartialCallableObjectProxy):
-                    pass
-                elif isinstance(wrapped, (types.FunctionType, types.MethodType)):
-                    # function, staticmethod or instancemethod
-                    bound_args = inspect.signature(wrapped).bind(*args, **kwargs)
-                    bound_args.apply_defaults()
-                    for k, v in bound_args.arguments.items():
-                        aspan.set_attribute(f"xs.span.arg.{k}", str(v))
-
-                # must be inside "aspan" to produce nested trace
-                result = wrapped(*args, **kwargs)
-            return result
-
-        def autoinstrument_class(aclass):
-            """Auto-instrument a class."""
-
-            t = tracers[0]
-            module_name = f"{aclass.__module__}:{aclass.__qualname__}"
-
-            with t.start_as_current_span(f"auto_instrumentation.add: {module_name}"):
-                for method_name, method in aclass.__dict__.items():
-                    if not callable(getattr(aclass, method_name)):
-                        continue
-
-                    with t.start_as_current_span(
-                        f"class.instrument:{module_name}.{method_name}={method}"
-                    ):
-                        # Avoid RecursionError:
-                        # 'maximum recursion depth exceeded in comparison'
-                        # in the XenAPI module (triggered by XMLRPC calls in it):
-                        if method_name in ["__getattr__", "__call__", "__init__"]:
-                            continue
-                        try:
-                            setattr(aclass, method_name, instrument_function(method))
-                        except Exception:
-                            debug(
-                                "setattr.instrument_function: Exception %s",
-                                traceback.format_exc(),
-                            )
-
-
-        def autoinstrument_module(amodule):
-            """Autoinstrument the classes and functions in a module."""
-
-            # Instrument the methods of the classes in the module
-            for _, aclass in inspect.getmembers(amodule, inspect.isclass):
-                try:
-                    autoinstrument_class(aclass)
-                except Exception:
-                    debug("instrument_function: Exception %s", traceback.format_exc())
-
-            # Instrument the module-level functions of the module
-            for fname, afunction in inspect.getmembers(amodule, inspect.isfunction):
-                setattr(amodule, fname, instrument_function(afunction))
+        if isinstance(wrapped, types.ModuleType):
+            autoinstrument_module(wrapped, span_name_prefix)
+            return wrapped
+        if isinstance(wrapped, type):
+            # A function can't replace a class (e.g. for isinstance() or subclassing)
+            autoinstrument_class(wrapped, span_name_prefix)
+            return wrapped
+        if is_instrumented(wrapped):  # Don't nest a second span around the call
+            return wrapped
 
-        if inspect.ismodule(wrapped):
-            autoinstrument_module(wrapped)
+        return instrument_function(wrapped, span_name_prefix=span_name_prefix)
 
-        return instrument_function(wrapped)
+    # The modules with a post-import hook, to register each hook only once:
+    patched_modules = set()
 
     def _patch_module(module_name):
-        wrapt.importer.discover_post_import_hooks(module_name)
+        if module_name in patched_modules:
+            return
+        patched_modules.add(module_name)
+        # when_imported() instruments the module right away if it is already
+        # imported, else on its import. discover_post_import_hooks() isn't needed:
+        # It only loads hooks from package entry points, scanning all packages.
         wrapt.importer.when_imported(module_name)(
             lambda hook: span_of_tracers(wrapped=hook)
         )
@@ -361,29 +691,104 @@ def _init_tracing(configs: List[str], config_dir: str):
     return span_of_tracers, _patch_module
 
 
-observer_config_dir = os.getenv("OBSERVER_CONFIG_DIR", default=".").strip("'")
-observer_configs = _get_configs_list(observer_config_dir)
-debug("configs = %s", observer_configs)
+# span and patch_module, once they are initialised by _init_observer()
+_observer: Tuple = ()
+
 
-try:
-    # If there are configs, span and patch_module are now operational
-    # and can be used to trace the program.
-    # If there are no configs, or an exception is raised, span and patch_module
-    # are not overridden and will be the defined no-op functions.
-    span, patch_module = _init_tracing(observer_configs, observer_config_dir)
+def _init_observer():
+    """
+    Initialise span and patch_module on their first use and return them.
+
+    The *observer.conf files are only read (and the opentelemetry packages only
+    imported) when span or patch_module is used, either by main() or by calling
+    them as functions of this module, not when it is imported.
+    """
+    global span, patch_module, _observer  # pylint: disable=global-statement
+    if _observer:
+        return _observer
 
-    # If tracing is now operational, explicity set "OTEL_SDK_DISABLED" to "false".
-    # In our case, different from the standard, we want the tracing disabled by
-    # default, so if the env variable is not set the noop implementation is used.
-    os.environ["OTEL_SDK_DISABLED"] = "false"
-except Exception as exc:
-    syslog.error("Exception while setting up tracing, running script untraced: %s", exc)
-    span, patch_module = _span_noop, _patch_module_noop
+    observer_config_dir = os.getenv("OBSERVER_CONFIG_DIR", default=".").strip("'")
+    observer_configs = _get_configs_list(observer_config_dir)
+    debug("configs = %s", observer_configs)
+
+    try:
+        # If there are configs, span and patch_module are now operational
+        # and can be used to trace the program.
+        # If there are no configs, or an exception is raised, span and patch_module
+        # are not overridden and will be the defined no-op functions.
+        span, patch_module = _init_tracing(observer_configs, observer_config_dir)
+
+        # If tracing is now operational, explicity set "OTEL_SDK_DISABLED" to "false".
+        # In our case, different from the standard, we want the tracing disabled by
+        # default, so if the env variable is not set the noop implementation is used.
+        os.environ["OTEL_SDK_DISABLED"] = "false"
+    except Exception as exc:
+        syslog.error(
+            "Exception while setting up tracing, running script untraced: %s", exc
+        )
+        span, patch_module = _span_noop, _patch_module_noop
+    _observer = span, patch_module
+    return _observer
+
+
+# Until the first use, span and patch_module initialise the observer and call the
+# span and patch_module that replace them then. This works on Python 3.6, too,
+# unlike a module __getattr__ (PEP 562):
+def span(wrapped=None, span_name_prefix=""):
+    """Trace calls of wrapped (a function, class or module), if tracing is on."""
+    return _init_observer()[0](wrapped, span_name_prefix=span_name_prefix)
+
+
+def patch_module(module_name):
+    """Trace the calls of the module when it is imported, if tracing is on."""
+    return _init_observer()[1](module_name)
+
+
+def _run_script(file):
+    """
+    Run the python script as __main__, like runpy.run_path(file, run_name="__main__")
+
+    Unlike runpy.run_path(), which compiles the script on each run, this loads
+    its code from __pycache__ like an imported module: The script is compiled
+    only when it changed (and the compiled code is cached if __pycache__ is
+    writable). Compiled scripts and directories or zip files with a __main__.py
+    are run by runpy.
+    """
+    from importlib.machinery import SourceFileLoader
+    from importlib.util import MAGIC_NUMBER
+    from pkgutil import get_importer
+
+    # Like runpy.run_path(): Only a directory or zip file has a path importer,
+    # and compiled code starts with the magic number (whatever its file suffix):
+    path = os.path.abspath(file)
+    run_by_runpy = get_importer(file) is not None
+    if not run_by_runpy:
+        with open(path, "rb") as script:
+            run_by_runpy = script.read(len(MAGIC_NUMBER)) == MAGIC_NUMBER
+    if run_by_runpy:
+        import runpy
+
+        runpy.run_path(file, run_name="__main__")
+        return
+
+    loader = SourceFileLoader("__main__", path)
+    code = loader.get_code("__main__")
+
+    # Like runpy, run the script in a new __main__ module (restored afterwards):
+    module = types.ModuleType("__main__")
+    module.__file__ = file
+    module.__loader__ = loader
+    main_module = sys.modules["__main__"]
+    sys.modules["__main__"] = module
+    try:
+        exec(code, module.__dict__)  # pylint: disable=exec-used
+    finally:
+        sys.modules["__main__"] = main_module
 
 
 def main():
     """
-    Run the passed python script using the runpy module, passing the given arguments.
+    Run the passed python script as __main__, passing the given arguments.
 
     The program will be automatically instrumented when the corresponding module
     in the program is imported.
@@ -397,6 +802,7 @@ def main():
     # Shift the arguments by one so that the program to run is first in sys.argv
     sys.argv = sys.argv[1:]
     argv0 = sys.argv[0]
+    span, _ = _init_observer()
 
     @span(span_name_prefix=argv0)
     def run(file):
@@ -405,7 +811,7 @@ def main():
         # Defensive error handling should hopefully only be needed in exceptional cases
         # but in case things go wrong, this may be a starting point for logging it:
         try:
-            runpy.run_path(file, run_name="__main__")
+            _run_script(file)
             return 0
         except FileNotFoundError as e:
             print(
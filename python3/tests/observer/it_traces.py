@@ -35,6 +35,7 @@ def assert_imported_modules(globals_dict_of_observer: Dict[str, Any]):
         "opentelemetry.exporter.zipkin.json",
         "opentelemetry.sdk.resources",
         "opentelemetry.sdk.trace.export",
+        "opentelemetry.sdk.trace.sampling",
         "opentelemetry.trace",
     ]
     assert all(mod in observer_modules for mod in imported_modules)
@@ -101,4 +102,4 @@ def assert_debug_logs(caplog: LogCaptureFixture):
     assert msg[3] == f"{testdir}/observer.conf: {config}"
 
     # Assert that the observer.py script created a tracer
-    assert msg[4].startswith("tracers=[<opentelemetry.sdk.trace.Tracer object at")
+    assert msg[4].startswith("tracer=<opentelemetry.sdk.trace.Tracer object at")
@@ -1,17 +1,25 @@
 """Test python3/packages/observer.py"""
 
+import importlib.util
+import json
+import logging
 import os
+import py_compile
 import sys
+import tempfile
 import unittest
 
 from unittest.mock import MagicMock, mock_open, patch
 
 # Ensure observer is initialised as noop
-with patch("os.listdir") as mock_listdir:
+with patch("os.scandir") as mock_scandir:
     # Prevent it finding an observer.conf
-    mock_listdir.return_value = []
+    mock_scandir.return_value.__enter__.return_value = []
     from python3.packages import observer
 
+    # span and patch_module are initialised on their first use:
+    observer._init_observer()
+
 TEST_CONFIG = """
     XS_EXPORTER_BUGTOOL_ENDPOINT='/var/log/dt/test'
     OTEL_SERVICE_NAME='test-observer'
@@ -22,7 +30,7 @@ OBSERVER_OPEN = "python3.packages.observer.open"
 
 #
 # These are the modules that are mocked to avoid dependencies.
-# Note: wrapt is not mocked: It is used to wrap the traced script.
+# Note: wrapt is not mocked: Its post-import hooks patch the traced modules.
 # These modules are not imported at the top of observer.py, but are
 # imported inside the observer._init_tracing(). This is why they are mocked
 # in the test class before calling observer._init_tracing() and then deleted
@@ -33,6 +41,7 @@ MOCKED_MODULES = [
     "opentelemetry.sdk.resources",
     "opentelemetry.sdk.trace",
     "opentelemetry.sdk.trace.export",
+    "opentelemetry.sdk.trace.sampling",
     "opentelemetry.exporter.zipkin.json",
     "opentelemetry.baggage.propagation",
     "opentelemetry.trace.propagation.tracecontext",
@@ -62,11 +71,28 @@ class TestObserver(unittest.TestCase):
         """A simple helper method for tests to wrap using observer.span"""
         return 5
 
+    @staticmethod
+    def init_tracing(read_data):
+        """Run the init_tracing method with an observer.conf containing read_data"""
+
+        with patch(OBSERVER_OPEN, mock_open(read_data=read_data)):
+            return observer._init_tracing([TEST_OBSERVER_CONF], ".")
+
+    @staticmethod
+    def tracer():
+        """Return the mocked tracer which the traced calls start their spans with"""
+        provider = sys.modules["opentelemetry.sdk.trace"].TracerProvider.return_value
+        return provider.get_tracer.return_value
+
+    def recording_span(self):
+        """Return the mocked span which the traced calls record their arguments in"""
+        span_context_manager = self.tracer().start_as_current_span.return_value
+        return span_context_manager.__enter__.return_value
+
     def init_tracing_and_run_simple_method(self, read_data):
         """Run the init_tracing method with the given read_data"""
 
-        with patch(OBSERVER_OPEN, mock_open(read_data=read_data)):
-            span, _ = observer._init_tracing([TEST_OBSERVER_CONF], ".")
+        span, _ = self.init_tracing(read_data)
 
         simple_method = span(self.simple_method)
         self.assertEqual(simple_method(), 5)
@@ -82,8 +108,7 @@ class TestObserver(unittest.TestCase):
         self.assertEqual(simple_method(), 5)
 
     def test_span_of_tracers_with_parameters(self):
-        with patch(OBSERVER_OPEN, mock_open(read_data="empty")):
-            span, _ = observer._init_tracing([TEST_OBSERVER_CONF], ".")
+        span, _ = self.init_tracing("empty")
 
         # This needs to use the decorator sugar so that wrapped is initially None
         @span(span_name_prefix="test")
@@ -92,6 +117,11 @@ class TestObserver(unittest.TestCase):
 
         self.assertEqual(simple_method(), 5)
 
+        # The span name is built when decorating, the call only passes it on:
+        self.tracer().start_as_current_span.assert_called_once_with(
+            f"test:{__name__}:{simple_method.__qualname__}"
+        )
+
     # Use the span method defined on import with no configs
     def test_span_after_import(self):
         simple_method = observer.span(self.simple_method)
@@ -106,26 +136,32 @@ class TestObserver(unittest.TestCase):
 
         self.assertEqual(simple_method(), 5)
 
-    @patch("os.path.isfile")
-    @patch("os.listdir")
-    def test_get_configs_list(self, mock_ls, mock_isfile):
-        mock_ls.return_value = [
-            "first-observer.conf",
-            "ignore.conf",
-            "second-observer.conf",
-        ]
-        mock_isfile.return_value = True
+    @patch("os.scandir")
+    def test_get_configs_list(self, mock_scandir):
+        entries = []
+        for name in ["second-observer.conf", "ignore.conf", "first-observer.conf"]:
+            entry = MagicMock(path=f"test-dir/{name}")
+            entry.name = name  # name is an argument of the MagicMock constructor
+            entry.is_file.return_value = True
+            entries.append(entry)
+        mock_scandir.return_value.__enter__.return_value = entries
         configs = observer._get_configs_list("test-dir")
 
         self.assertEqual(
             configs, ["test-dir/first-observer.conf", "test-dir/second-observer.conf"]
         )
+        entries[1].is_file.assert_not_called()
 
     def test_configs_directory_not_found(self):
         configs = observer._get_configs_list("non-existent")
 
         self.assertEqual(configs, [])
 
+    def test_configs_directory_is_a_file(self):
+        configs = observer._get_configs_list(__file__)
+
+        self.assertEqual(configs, [])
+
     def test_configs_exist(self):
         self.init_tracing_and_run_simple_method(read_data=TEST_CONFIG)
         self.assertEqual(os.environ["OTEL_RESOURCE_ATTRIBUTES"], "service.name=sm")
@@ -147,9 +183,513 @@ class TestObserver(unittest.TestCase):
         return a + b
 
     def test_tracing_with_arguments(self):
-        with patch(OBSERVER_OPEN, mock_open(read_data="empty")):
-            span, _ = observer._init_tracing([TEST_OBSERVER_CONF], ".")
+        span, _ = self.init_tracing("empty")
 
         simple_method_with_args = span(self.simple_method_with_args)
 
         self.assertEqual(simple_method_with_args(5), 8)
+
+    def test_signature_of_is_cached(self):
+        signature = observer._signature_of(TestObserver.simple_method_with_args)
+
+        self.assertEqual(list(signature.parameters), ["self", "a", "b"])
+        self.assertIs(
+            observer._signature_of(TestObserver.simple_method_with_args), signature
+        )
+        bound = observer._signature_of(TestObserver.simple_method_with_args, True)
+        self.assertEqual(list(bound.parameters), ["a", "b"])
+
+        def function_without_signature():
+            pass
+
+        function_without_signature.__signature__ = "invalid"  # type: ignore
+        self.assertIsNone(observer._signature_of(function_without_signature))
+
+    def test_tracing_a_method_with_only_var_positional_arguments(self):
+        class Instrumented:
+            def method(*args):  # pylint: disable=no-method-argument
+                return args[1:]
+
+        bound = observer._signature_of(Instrumented.__dict__["method"], True)
+        self.assertEqual(list(bound.parameters), ["args"])
+
+        span, _ = self.init_tracing("empty")
+        span(Instrumented)
+
+        self.assertEqual(Instrumented().method(1, 2), (1, 2))
+        self.recording_span().set_attribute.assert_called_once_with(
+            "xs.span.args", "{'args': (1, 2)}"
+        )
+
+    def test_tracing_a_function_of_a_class_called_through_the_class(self):
+        class Namespace:
+            def helper(a, b):  # pylint: disable=no-self-argument
+                return a + b
+
+        span, _ = self.init_tracing("empty")
+        span(Namespace)
+
+        self.assertEqual(Namespace.helper(a=1, b=2), 3)
+        self.recording_span().set_attribute.assert_not_called()
+
+    def test_tracing_sets_arguments_attribute(self):
+        span, _ = self.init_tracing("empty")
+        aspan = self.recording_span()
+
+        self.assertEqual(span(self.simple_method_with_args)(5), 8)
+        aspan.set_attribute.assert_called_once_with("xs.span.args", "{'a': 5, 'b': 3}")
+
+    def test_tracing_sets_detailed_arguments_attributes(self):
+        span, _ = self.init_tracing("detailed_args=true")
+        aspan = self.recording_span()
+        aspan.reset_mock()
+
+        self.assertEqual(span(self.simple_method_with_args)(5), 8)
+        aspan.set_attributes.assert_called_once_with(
+            {"xs.span.arg.a": 5, "xs.span.arg.b": 3}
+        )
+
+    def test_tracing_abbreviates_large_arguments(self):
+        read_data = "detailed_args=true\nmax_arg_length=8"
+        span, _ = self.init_tracing(read_data)
+        aspan = self.recording_span()
+        aspan.reset_mock()
+
+        result = span(self.simple_method_with_args)("12345678", "123456789")
+
+        self.assertEqual(result, "12345678123456789")
+        aspan.set_attributes.assert_called_once_with(
+            {"xs.span.arg.a": "12345678", "xs.span.arg.b": "'1...89'"}
+        )
+
+    def test_tracing_without_capture_args(self):
+        span, _ = self.init_tracing("capture_args=false")
+        aspan = self.recording_span()
+        aspan.reset_mock()
+
+        self.assertEqual(span(self.simple_method_with_args)(5), 8)
+        aspan.set_attribute.assert_not_called()
+
+    def test_span_and_patch_module_initialise_the_observer_on_first_use(self):
+        self.assertIs(observer.patch_module, observer._patch_module_noop)
+
+        spec = importlib.util.spec_from_file_location("observer", observer.__file__)
+        fresh_observer = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(fresh_observer)
+        self.assertEqual(fresh_observer.span.__name__, "span")
+
+        with patch("os.scandir") as mock_scandir:
+            mock_scandir.return_value.__enter__.return_value = []
+            self.assertEqual(fresh_observer.span(self.simple_method)(), 5)
+        self.assertIs(fresh_observer.span, fresh_observer._span_noop)
+        self.assertIs(fresh_observer.patch_module, fresh_observer._patch_module_noop)
+
+    def test_span_of_class_instruments_its_methods(self):
+        class Instrumented:
+            def method(self, a):
+                return a
+
+            @staticmethod
+            def static_method(a):
+                return a
+
+            @classmethod
+            def class_method(cls, a):
+                return cls, a
+
+        read_data = "instrument_static_and_class_methods=true"
+        span, _ = self.init_tracing(read_data)
+
+        self.assertIs(span(Instrumented), Instrumented)
+        self.assertTrue(hasattr(Instrumented.method, "__wrapped__"))
+        self.assertEqual(Instrumented().method(1), 1)
+        self.assertEqual(Instrumented.static_method(2), 2)
+        self.assertEqual(Instrumented().class_method(3), (Instrumented, 3))
+
+    def test_read_config_is_cached(self):
+        all_conf = os.path.join(os.path.dirname(__file__), "observer", "all.conf")
+        config = observer.read_config(all_conf)
+
+        self.assertEqual(config["module_names"], "XenAPI,tests.observer.traced_script")
+        self.assertIs(observer.read_config(all_conf), config)
+
+    def test_read_config_rereads_changed_files(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_path = os.path.join(tmpdir, "test-observer.conf")
+            with open(config_path, "w", encoding="utf-8") as config_file:
+                config_file.write("key=old")
+            self.assertEqual(observer.read_config(config_path), {"key": "old"})
+
+            with open(config_path, "w", encoding="utf-8") as config_file:
+                config_file.write("key=new")
+            os.utime(config_path, ns=(0, 0))  # Changes the mtime in any case
+
+            self.assertEqual(observer.read_config(config_path), {"key": "new"})
+            self.assertEqual(observer._CONFIG_CACHE[config_path][1], {"key": "new"})
+
+    def test_tracing_skips_arguments_if_not_recording(self):
+        span, _ = self.init_tracing("empty")
+        aspan = self.recording_span()
+        aspan.is_recording.return_value = False
+
+        with patch("inspect.Signature.bind") as mock_bind:
+            self.assertEqual(span(self.simple_method_with_args)(5), 8)
+        mock_bind.assert_not_called()
+        aspan.set_attribute.assert_not_called()
+
+    def test_read_config(self):
+        read_data = "# comment\n\n OTEL_SERVICE_NAME = 'test' \nkey=a=b\n"
+        with patch(OBSERVER_OPEN, mock_open(read_data=read_data)):
+            config = observer.read_config(TEST_OBSERVER_CONF)
+
+        self.assertEqual(config, {"otel_service_name": "test", "key": "a=b"})
+
+        read_data = "url=http://localhost:9411\nkey: value\n"
+        with patch(OBSERVER_OPEN, mock_open(read_data=read_data)):
+            config = observer.read_config(TEST_OBSERVER_CONF)
+
+        self.assertEqual(config, {"url": "http://localhost:9411", "key": "value"})
+
+        with patch(OBSERVER_OPEN, mock_open(read_data="key=value\ninvalid\n")):
+            config = observer.read_config(TEST_OBSERVER_CONF)
+
+        self.assertEqual(config, {})
+
+    def test_span_of_class_excludes_methods(self):
+        class Instrumented:
+            def method(self):
+                return 1
+
+            def _private_method(self):
+                return 2
+
+            @staticmethod
+            def static_method():
+                return 3
+
+        read_data = "instrument_exclude_patterns=_*"
+        span, _ = self.init_tracing(read_data)
+        span(Instrumented)
+
+        self.assertTrue(hasattr(Instrumented.method, "__wrapped__"))
+        self.assertFalse(hasattr(Instrumented._private_method, "__wrapped__"))
+        self.assertFalse(hasattr(Instrumented.static_method, "__wrapped__"))
+
+    def test_span_of_class_does_not_instrument_twice(self):
+        class Instrumented:
+            def method(self):
+                return 1
+
+        span, _ = self.init_tracing("empty")
+        span(Instrumented)
+        instrumented_method = Instrumented.method
+        span(Instrumented)
+
+        self.assertIs(Instrumented.method, instrumented_method)
+
+    def test_untraced_script_is_not_traced(self):
+        read_data = "traced_scripts=other_script.py"
+        span, patch_module = self.init_tracing(read_data)
+
+        self.assertEqual(span.__name__, "_span_noop")
+        self.assertEqual(patch_module.__name__, "_patch_module_noop")
+
+    def test_configs_with_the_same_destination_share_an_exporter(self):
+        read_data = "xs_exporter_zipkin_endpoints=http://localhost:9411/api/v2/spans"
+        with patch(OBSERVER_OPEN, mock_open(read_data=read_data)):
+            observer._init_tracing([TEST_OBSERVER_CONF, TEST_OBSERVER_CONF], ".")
+
+        processor = sys.modules["opentelemetry.sdk.trace.export"].BatchSpanProcessor
+        processor.assert_called_once()
+
+    def test_configs_with_other_resource_attributes_share_the_exporters(self):
+        bugtool = "xs_exporter_bugtool_endpoint=/var/log/dt/test\n"
+        endpoints = "xs_exporter_zipkin_endpoints=http://localhost:9411/api/v2/spans"
+        configs = [
+            "empty",  # all.conf
+            bugtool + "otel_resource_attributes=a=1",
+            bugtool + "otel_resource_attributes=b=2\n" + endpoints,
+        ]
+        with patch(OBSERVER_OPEN) as mock_file:
+            mock_file.return_value.__enter__.side_effect = [
+                mock_open(read_data=config).return_value for config in configs
+            ]
+            observer._init_tracing(["1-observer.conf", "2-observer.conf"], ".")
+
+        # One exporter for the bugtool directory and one for the Zipkin endpoint:
+        processor = sys.modules["opentelemetry.sdk.trace.export"].BatchSpanProcessor
+        self.assertEqual(processor.call_count, 2)
+
+    def test_configs_with_other_destinations_share_a_tracer_provider(self):
+        endpoints = "xs_exporter_zipkin_endpoints=http://{}:9411/api/v2/spans"
+        with patch(OBSERVER_OPEN) as mock_file:
+            mock_file.return_value.__enter__.side_effect = [
+                mock_open(read_data="empty").return_value,  # all.conf
+                mock_open(read_data=endpoints.format("localhost")).return_value,
+                mock_open(read_data=endpoints.format("otherhost")).return_value,
+            ]
+            observer._init_tracing(["1-observer.conf", "2-observer.conf"], ".")
+
+        provider = sys.modules["opentelemetry.sdk.trace"].TracerProvider
+        provider.assert_called_once()
+        self.assertEqual(provider.return_value.add_span_processor.call_count, 2)
+
+    def test_resource_attribute_values_may_contain_equal_signs(self):
+        read_data = "otel_resource_attributes=service.name=sm,xs.key=a=b,invalid"
+        self.init_tracing(read_data)
+
+        propagator = sys.modules["opentelemetry.baggage.propagation"]
+        propagator.W3CBaggagePropagator.return_value.extract.assert_called_once_with(
+            {}, {"service.name": "sm", "xs.key": "a=b"}
+        )
+
+    def test_span_does_not_instrument_a_function_twice(self):
+        span, _ = self.init_tracing("empty")
+        instrumented_method = span(self.simple_method)
+
+        self.assertIs(span(instrumented_method), instrumented_method)
+
+    def test_span_returns_a_plain_function(self):
+        span, _ = self.init_tracing("empty")
+        instrumented_method = span(self.simple_method)
+
+        # A closure made using functools.wraps(), not a wrapt.FunctionWrapper proxy:
+        self.assertIsInstance(instrumented_method, observer.types.FunctionType)
+        self.assertEqual(instrumented_method.__name__, "simple_method")
+        self.assertEqual(instrumented_method.__wrapped__, self.simple_method)
+        self.assertEqual(instrumented_method(), 5)
+
+    def test_span_of_class_skips_the_skipped_methods(self):
+        class Instrumented:
+            def __repr__(self):
+                return "Instrumented()"
+
+            def __eq__(self, other):
+                return self is other
+
+        read_data = "instrument_exclude_patterns=_private*"
+        span, _ = self.init_tracing(read_data)
+        span(Instrumented)
+
+        self.assertFalse(hasattr(Instrumented.__repr__, "__wrapped__"))
+        self.assertTrue(hasattr(Instrumented.__eq__, "__wrapped__"))
+
+    def test_resource_attributes_of_all_configs_are_merged(self):
+        with patch(OBSERVER_OPEN) as mock_file:
+            mock_file.return_value.__enter__.side_effect = [
+                mock_open(read_data="empty").return_value,  # all.conf
+                mock_open(read_data="otel_resource_attributes=a=1").return_value,
+                mock_open(read_data="otel_resource_attributes=b=2").return_value,
+            ]
+            observer._init_tracing(["1-observer.conf", "2-observer.conf"], ".")
+
+        self.assertEqual(os.environ["OTEL_RESOURCE_ATTRIBUTES"], "a=1,b=2")
+
+    def test_patch_module_instruments_an_imported_module(self):
+        def function():
+            return 1
+
+        module = observer.types.ModuleType("test_observer_imported_module")
+        module.function = function
+        _, patch_module = self.init_tracing("empty")
+
+        with patch.dict(sys.modules, {module.__name__: module}):
+            patch_module(module.__name__)
+
+        self.assertIs(module.function.__wrapped__, function)
+        self.assertEqual(module.function(), 1)
+
+    def test_patch_module_registers_its_hook_only_once(self):
+        _, patch_module = self.init_tracing("empty")
+
+        with patch("wrapt.importer.when_imported") as when_imported:
+            patch_module("test_observer_module")
+            patch_module("test_observer_module")
+
+        when_imported.assert_called_once_with("test_observer_module")
+
+    def test_sampling_ratio_zero_without_sampled_traceparent(self):
+        traceparent = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-0"
+        for flags, expected_span in [("0", "_span_noop"), ("1", "span_of_tracers")]:
+            with patch.dict(os.environ, {"TRACEPARENT": traceparent + flags}):
+                span, _ = self.init_tracing("sampling_ratio=0")
+
+            self.assertEqual(span.__name__, expected_span)
+
+    def test_syslog_handler_is_not_on_the_root_logger(self):
+        def is_observer_handler(handler):
+            return isinstance(handler, observer._LazySysLogHandler)
+
+        self.assertFalse(any(map(is_observer_handler, logging.getLogger().handlers)))
+        self.assertTrue(any(map(is_observer_handler, observer.syslog.handlers)))
+
+        with patch("os.path.exists", return_value=False):
+            handler = observer._LazySysLogHandler().create_syslog_handler()
+        self.assertIsInstance(handler, logging.NullHandler)
+
+    def test_run_script_caches_its_bytecode(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            script = os.path.join(tmpdir, "script.py")
+            with open(script, "w", encoding="utf-8") as script_file:
+                script_file.write("import sys\nsys.ran_as = __name__\n")
+
+            main_module = sys.modules["__main__"]
+            with patch.object(sys, "dont_write_bytecode", False):
+                observer._run_script(script)
+            self.assertEqual(sys.__dict__.pop("ran_as"), "__main__")
+            self.assertIs(sys.modules["__main__"], main_module)
+
+            # The next runs load the code compiled by this run from __pycache__:
+            self.assertTrue(os.path.exists(importlib.util.cache_from_source(script)))
+
+    def test_run_script_runs_a_directory_with_a_main_module(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(f"{tmpdir}/__main__.py", "w", encoding="utf-8") as script_file:
+                script_file.write("import sys\nsys.ran_as = __name__\n")
+
+            observer._run_script(tmpdir)
+            self.assertEqual(sys.__dict__.pop("ran_as"), "__main__")
+
+            with self.assertRaises(FileNotFoundError):
+                observer._run_script(f"{tmpdir}/missing.py")
+
+    def test_run_script_runs_a_compiled_script(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            script = os.path.join(tmpdir, "script.py")
+            with open(script, "w", encoding="utf-8") as script_file:
+                script_file.write("import sys\nsys.ran_as = __name__\n")
+            compiled_script = os.path.join(tmpdir, "compiled")  # Any file name
+            py_compile.compile(script, cfile=compiled_script, doraise=True)
+
+            observer._run_script(compiled_script)
+            self.assertEqual(sys.__dict__.pop("ran_as"), "__main__")
+
+
+class TestFileZipkinExporter(unittest.TestCase):
+    """Test the FileZipkinExporter of observer.py using the OpenTelemetry SDK"""
+
+    def setUp(self) -> None:
+        # Remove the modules imported by the test afterwards, like TestObserver:
+        modules = patch.dict(sys.modules)
+        modules.start()
+        self.addCleanup(modules.stop)
+        # Import all of OpenTelemetry afresh: Other tests replace (and delete) some
+        # of its modules, and its remaining modules would refer to the old ones:
+        for name in list(sys.modules):
+            if name.split(".")[0] == "opentelemetry":
+                del sys.modules[name]
+        tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmpdir.cleanup)
+        self.config_dir = tmpdir.name
+        self.trace_log_dir = os.path.join(tmpdir.name, "trace")
+        return super().setUp()
+
+    def init_exporter(self, all_conf="empty"):
+        """Return the FileZipkinExporter created by _init_tracing() for all_conf"""
+        observer_conf = os.path.join(self.config_dir, "test-observer.conf")
+        with open(observer_conf, "w", encoding="utf-8") as config_file:
+            config_file.write(f"xs_exporter_bugtool_endpoint={self.trace_log_dir}")
+        with open(f"{self.config_dir}/all.conf", "w", encoding="utf-8") as config_file:
+            config_file.write(all_conf)
+
+        processor = "opentelemetry.sdk.trace.export.BatchSpanProcessor"
+        with patch(processor) as batch_span_processor:
+            observer._init_tracing([observer_conf], self.config_dir)
+        exporter = batch_span_processor.call_args.args[0]
+        self.addCleanup(exporter.shutdown)
+        return exporter
+
+    @staticmethod
+    def finished_spans():
+        """Return finished spans to export, created by a separate TracerProvider"""
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+        from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+            InMemorySpanExporter,
+        )
+
+        memory_exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(memory_exporter))
+        tracer = provider.get_tracer(__name__)
+        with tracer.start_as_current_span("parent", attributes={"key": "value"}):
+            with tracer.start_as_current_span("child"):
+                pass
+        return memory_exporter.get_finished_spans()
+
+    def test_export_appends_the_batches_to_one_ndjson_file(self):
+        exporter = self.init_exporter()
+        self.assertFalse(os.listdir(self.trace_log_dir))  # Opened on the first export
+
+        for _ in range(2):
+            exporter.export(self.finished_spans())
+        exporter.bugtool_file.flush()
+
+        # Named by service name, host uuid, tracestate, start time, pid and number:
+        filename = os.path.basename(exporter.bugtool_filename)
+        self.assertRegex(filename, rf"^unknown-unknown-unknown-.*-{os.getpid()}-000000")
+        self.assertEqual(os.listdir(self.trace_log_dir), [filename])
+        with open(exporter.bugtool_filename, "rb") as bugtool_file:
+            data = bugtool_file.read()
+        self.assertEqual(exporter.bytes_written, len(data))  # Including newlines
+        batches = [json.loads(line) for line in data.splitlines()]
+        for batch in batches:
+            self.assertEqual([span["name"] for span in batch], ["child", "parent"])
+            self.assertEqual(batch[1]["tags"]["key"], "value")
+        self.assertEqual(len(batches), 2)
+
+        exporter.shutdown()
+        self.assertTrue(exporter.bugtool_file.closed)
+
+    @unittest.skipUnless(importlib.util.find_spec("orjson"), "orjson is not installed")
+    def test_orjson_encoder_serializes_like_the_json_v2_encoder(self):
+        from opentelemetry.exporter.zipkin.json.v2 import JsonV2Encoder
+
+        exporter = self.init_exporter()
+        spans = self.finished_spans()
+        encoder = JsonV2Encoder(exporter.encoder.max_tag_value_length)
+
+        self.assertIsNot(type(exporter.encoder), JsonV2Encoder)  # The orjson one
+        data = exporter.encoder.serialize(spans, exporter.local_node)
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(
+            json.loads(data), json.loads(encoder.serialize(spans, exporter.local_node))
+        )
+
+    def test_export_rotates_and_compresses_full_files(self):
+        exporter = self.init_exporter("bugtool_max_file_bytes=1")
+        spans = self.finished_spans()
+
+        with patch("threading.Thread") as thread:
+            exporter.export(spans)
+        first_file = exporter.bugtool_filename
+        thread.assert_called_once_with(
+            target=exporter.compress_file, args=(first_file,)
+        )
+        thread.return_value.start.assert_called_once_with()
+        self.assertIsNone(exporter.bugtool_file)
+        self.assertEqual(exporter.bytes_written, 0)
+
+        # The next export opens the next file:
+        with patch("threading.Thread"):
+            exporter.export(spans)
+        self.assertNotEqual(exporter.bugtool_filename, first_file)
+        self.assertTrue(exporter.bugtool_filename.endswith("-000001.ndjson"))
+
+    def test_export_continues_if_the_compression_cannot_start(self):
+        exporter = self.init_exporter("bugtool_max_file_bytes=1")
+        spans = self.finished_spans()
+
+        with patch("threading.Thread") as thread:
+            thread.return_value.start.side_effect = RuntimeError("shutdown")
+            exporter.export(spans)
+            first_file = exporter.bugtool_filename
+            self.assertIsNone(exporter.bugtool_file)
+
+            exporter.export(spans)
+
+        # The full file is left uncompressed, and the next batch is in a new file:
+        files = [first_file, exporter.bugtool_filename]
+        self.assertEqual(
+            sorted(os.listdir(self.trace_log_dir)), sorted(map(os.path.basename, files))
+        )